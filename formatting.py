@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Валюты отображения: подпись и число знаков после запятой
+CURRENCY_LABELS = {"rub": "₽", "usd": "$", "btc": "BTC"}
+CURRENCY_DECIMALS = {"rub": 0, "usd": 0, "btc": 6}
+
+def format_number(value, decimals=0, currency="rub"):
+    """Форматирует число с пробелами между тысячами"""
+    if pd.isna(value) or value == 0:
+        return "0"
+    try:
+        if decimals == 0:
+            formatted = "{:,.0f}".format(value).replace(",", " ")
+        else:
+            formatted = "{:,.{}f}".format(value, decimals).replace(",", " ").replace(".", ",")
+        
+        if currency == "usd":
+            return f"${formatted}"
+        elif currency == "rub":
+            return f"{formatted} ₽"
+        elif currency == "btc":
+            return f"{formatted} BTC"
+        return formatted
+    except:
+        return str(value)
+
+def format_column(values, decimals=0, currency="rub"):
+    """То же, что format_number, но для целого столбца за один проход"""
+    numeric = pd.to_numeric(pd.Series(values), errors="coerce")
+    text = pd.Series(
+        np.char.mod(f"%.{decimals}f", numeric.fillna(0).to_numpy(dtype=float)),
+        index=numeric.index
+    )
+    parts = text.str.partition(".")
+    formatted = parts[0].str.replace(r"(\d)(?=(\d{3})+$)", r"\1 ", regex=True)
+    if decimals:
+        formatted = formatted + "," + parts[2]
+
+    if currency == "usd":
+        formatted = "$" + formatted
+    elif currency == "rub":
+        formatted = formatted + " ₽"
+    elif currency == "btc":
+        formatted = formatted + " BTC"
+    return formatted.where(numeric.notna() & (numeric != 0), "0")
+
+def format_columns(df, columns, decimals=0, currency="rub"):
+    """Копия таблицы, в которой перечисленные столбцы заменены строками"""
+    formatted = df.copy()
+    for column in columns:
+        if column in formatted.columns:
+            formatted[column] = format_column(formatted[column], decimals, currency)
+    return formatted
+
+def add_wallet_column(df, currency="rub"):
+    """Подпись кошелька для отображения из числовых столбцов wallet_btc
+    и wallet_value"""
+    if "wallet_btc" not in df.columns:
+        return df
+    decimals = 2 if currency == "usd" else CURRENCY_DECIMALS.get(currency, 0)
+    btc = pd.Series(np.char.mod("%.8f", df["wallet_btc"].to_numpy(dtype=float)), index=df.index)
+    labels = btc + " BTC (" + format_column(df["wallet_value"], decimals, currency) + ")"
+    return df.drop(columns=["wallet_btc", "wallet_value"]).assign(Кошелек=labels)
@@ -0,0 +1,410 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Сколько последних расчетов хранится в памяти процесса
+SIMULATION_CACHE_SIZE = 128
+
+# Расчет ведется в рублях; остальные валюты - пересчет при отображении
+BASE_CURRENCY = "rub"
+MONEY_COLUMNS = ("Доходы", "Расходы", "Прибыль", "Зарплата", "Реинвест",
+                 "В кошелек", "Накопления", "wallet_value")
+
+# Расчетный месяц - 30 дней
+DAYS_PER_MONTH = 30
+
+# Блоки без покупок короче этого числа месяцев выгоднее считать по шагам
+STEP_BLOCK_MONTHS = 8
+
+# Параметры, от которых зависит результат расчета
+SIMULATION_PARAMS = ("asic_count", "asic_power", "asic_price", "electricity")
+SCENARIO_FIELDS = ("start", "end", "reinvest", "wallet")
+RATE_FIELDS = ("usd_rub", "btc_usd", "daily_profit_usd")
+
+_simulation_cache = OrderedDict()
+_simulation_lock = threading.Lock()
+
+class ScenarioError(ValueError):
+    """Некорректная раскладка сценариев"""
+
+class ScenarioTable:
+    """Сценарии, разложенные по месяцам: month_index[month - 1] - номер
+    сценария для месяца или -1, если месяц не покрыт ни одним сценарием.
+    При пересечении действует сценарий, стоящий в списке раньше"""
+
+    def __init__(self, scenarios, month_index, overlaps, gaps):
+        self.scenarios = scenarios
+        self.month_index = month_index
+        self.total_months = len(month_index)
+        self.overlaps = overlaps
+        self.gaps = gaps
+
+    def segments(self):
+        """Непрерывные отрезки месяцев с одним сценарием: (start, end, scenario)"""
+        segments = []
+        start = 1
+        for month in range(2, self.total_months + 2):
+            if month > self.total_months or self.month_index[month - 1] != self.month_index[start - 1]:
+                index = self.month_index[start - 1]
+                if index >= 0:
+                    segments.append((start, month - 1, self.scenarios[index]))
+                start = month
+        return segments
+
+    def warnings(self):
+        """Описание пересечений и пропусков для пользователя"""
+        messages = []
+        for start, end in self.overlaps:
+            messages.append(
+                f"Месяцы {start}–{end} входят в несколько периодов, "
+                "используется период, указанный раньше"
+            )
+        for start, end in self.gaps:
+            messages.append(f"Месяцы {start}–{end} не входят ни в один период и пропускаются")
+        return messages
+
+def _month_ranges(flags):
+    """Непрерывные диапазоны месяцев (с 1), для которых флаг истинен"""
+    ranges = []
+    start = None
+    for month, flag in enumerate(flags, start=1):
+        if flag and start is None:
+            start = month
+        elif not flag and start is not None:
+            ranges.append((start, month - 1))
+            start = None
+    if start is not None:
+        ranges.append((start, len(flags)))
+    return ranges
+
+def compile_scenarios(scenarios, default_months=12):
+    """Проверяем сценарии и раскладываем их в таблицу по месяцам"""
+    for number, scenario in enumerate(scenarios, start=1):
+        if scenario["start"] < 1:
+            raise ScenarioError(f"Период {number}: начальный месяц должен быть не меньше 1")
+        if scenario["end"] < scenario["start"]:
+            raise ScenarioError(f"Период {number}: конечный месяц раньше начального")
+        for field, title in (("reinvest", "реинвестиций"), ("wallet", "кошелька")):
+            if not 0 <= scenario[field] <= 100:
+                raise ScenarioError(f"Период {number}: процент {title} должен быть от 0 до 100")
+
+    total_months = max(int(s["end"]) for s in scenarios) if scenarios else default_months
+    month_index = [-1] * total_months
+    coverage = [0] * (total_months + 1)
+    # Заполняем с конца, чтобы при пересечении победил более ранний сценарий
+    for index in range(len(scenarios) - 1, -1, -1):
+        start, end = int(scenarios[index]["start"]), int(scenarios[index]["end"])
+        month_index[start - 1:end] = [index] * (end - start + 1)
+        coverage[start - 1] += 1
+        coverage[end] -= 1
+
+    counts = []
+    covered = 0
+    for month in range(total_months):
+        covered += coverage[month]
+        counts.append(covered)
+
+    return ScenarioTable(
+        scenarios,
+        month_index,
+        overlaps=_month_ranges([count > 1 for count in counts]),
+        gaps=_month_ranges([count == 0 for count in counts]) if scenarios else []
+    )
+
+def _canonical_number(value):
+    if isinstance(value, bool):
+        return value
+    value = float(value)
+    # Целые значения остаются целыми: 3 и 3.0 дают один хеш, а расчет по
+    # каноническим данным - те же типы столбцов, что и по исходным
+    return int(value) if value.is_integer() else value
+
+def canonical_inputs(params, scenarios, rates):
+    """Входные данные расчета в каноническом виде: только значимые поля,
+    дробные числа - float, целые - int"""
+    return {
+        "params": {key: _canonical_number(params[key]) for key in SIMULATION_PARAMS},
+        "scenarios": [
+            {key: _canonical_number(scenario[key]) for key in SCENARIO_FIELDS}
+            for scenario in scenarios
+        ],
+        "rates": {key: _canonical_number(rates[key]) for key in RATE_FIELDS}
+    }
+
+def inputs_fingerprint(params, scenarios, rates):
+    """Хеш канонических входных данных расчета"""
+    payload = json.dumps(canonical_inputs(params, scenarios, rates),
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _accumulate(initial, step, count):
+    """Значения initial + step, initial + 2 * step, ... с тем же порядком
+    сложений, что и в пошаговом цикле"""
+    values = np.full(count + 1, step, dtype=float)
+    values[0] = initial
+    return np.add.accumulate(values)[1:]
+
+class _ResultColumns:
+    """Накопитель результатов: месяцы пошагового расчета собираются в
+    списки, векторизованные блоки - готовыми массивами"""
+
+    FIELDS = ("month", "asics", "profit", "cost", "salary",
+              "to_reinvest", "to_wallet", "savings", "wallet_btc")
+
+    def __init__(self):
+        self.chunks = {name: [] for name in self.FIELDS}
+        self.rows = {name: [] for name in self.FIELDS}
+
+    def add_row(self, **values):
+        for name, value in values.items():
+            self.rows[name].append(value)
+
+    def add_block(self, **arrays):
+        self._flush_rows()
+        for name, values in arrays.items():
+            self.chunks[name].append(values)
+
+    def _flush_rows(self):
+        if self.rows["month"]:
+            for name in self.FIELDS:
+                self.chunks[name].append(np.array(self.rows[name]))
+                self.rows[name] = []
+
+    def arrays(self):
+        """Столбцы результата или None, если ни один месяц не посчитан"""
+        self._flush_rows()
+        if not self.chunks["month"]:
+            return None
+        return {name: np.concatenate(parts) for name, parts in self.chunks.items()}
+
+def _simulate_segment(start, end, scenario, state, constants, columns):
+    """Расчет отрезка с одним сценарием. Пока число ASIC не меняется, все
+    месячные величины постоянны, а накопления и кошелек растут
+    арифметически - такие блоки считаются массивами до месяца покупки.
+    Если покупка ближе STEP_BLOCK_MONTHS месяцев, считаем по шагам"""
+    daily_profit_per_asic_rub, daily_cost_per_asic_rub, asic_price, usd_rub, btc_usd = constants
+    # Цена и списание за покупку считаются в том же порядке операций, что и
+    # в пошаговом цикле: иное округление меняет число ASIC на границе покупки
+    asic_price_rub = asic_price * usd_rub
+    reinvest_share = scenario["reinvest"] / 100
+    wallet_share = scenario["wallet"] / 100
+
+    month = start
+    while month <= end:
+        current_asics = state["asics"]
+        profit = daily_profit_per_asic_rub * DAYS_PER_MONTH * current_asics
+        cost = daily_cost_per_asic_rub * DAYS_PER_MONTH * current_asics
+        to_reinvest = profit * reinvest_share
+        salary = profit - to_reinvest
+        to_wallet = to_reinvest * wallet_share
+        to_asics = to_reinvest - to_wallet
+        btc_amount = to_wallet / usd_rub / btc_usd
+
+        remaining = end - month + 1
+        if to_asics > 0:
+            # Месяцев до следующей покупки по закрытой формуле, с запасом
+            # на погрешность - точный месяц находим по накоплениям
+            estimate = max(math.ceil((asic_price_rub - state["savings"]) / to_asics), 1)
+            window = min(remaining, estimate + 1)
+        else:
+            estimate = None
+            window = remaining
+
+        if window == 1 or (estimate is not None and estimate <= STEP_BLOCK_MONTHS):
+            savings = state["savings"] + to_asics
+            wallet_btc = state["wallet_btc"] + btc_amount
+            new_asics = int(savings // asic_price_rub)
+            if new_asics > 0:
+                current_asics += new_asics
+                savings -= new_asics * asic_price * usd_rub
+            columns.add_row(
+                month=month, asics=current_asics, profit=profit, cost=cost,
+                salary=salary, to_reinvest=to_reinvest, to_wallet=to_wallet,
+                savings=savings, wallet_btc=wallet_btc
+            )
+            count = 1
+        else:
+            savings_values = _accumulate(state["savings"], to_asics, window)
+            if estimate is not None:
+                purchase = np.flatnonzero(savings_values >= asic_price_rub)
+                if len(purchase) == 0 and window < remaining:
+                    window = remaining
+                    savings_values = _accumulate(state["savings"], to_asics, window)
+                    purchase = np.flatnonzero(savings_values >= asic_price_rub)
+                if len(purchase):
+                    window = int(purchase[0]) + 1
+                    savings_values = savings_values[:window].copy()
+            wallet_values = _accumulate(state["wallet_btc"], btc_amount, window)
+            asics_values = np.full(window, current_asics)
+            new_asics = int(savings_values[-1] // asic_price_rub)
+            if new_asics > 0:
+                current_asics += new_asics
+                savings_values[-1] -= new_asics * asic_price * usd_rub
+                asics_values[-1] = current_asics
+            savings = savings_values[-1]
+            wallet_btc = wallet_values[-1]
+            columns.add_block(
+                month=np.arange(month, month + window),
+                asics=asics_values,
+                profit=np.full(window, profit),
+                cost=np.full(window, cost),
+                salary=np.full(window, salary),
+                to_reinvest=np.full(window, to_reinvest),
+                to_wallet=np.full(window, to_wallet),
+                savings=savings_values,
+                wallet_btc=wallet_values
+            )
+            count = window
+
+        state["asics"] = current_asics
+        state["savings"] = float(savings)
+        state["wallet_btc"] = float(wallet_btc)
+        month += count
+
+def run_simulation(params, scenarios, rates):
+    """Помесячный расчет: прибыль, расходы, реинвестиции, кошелек и
+    покупка новых ASIC"""
+    asic_power = params["asic_power"]
+    electricity = params["electricity"]
+    usd_rub = rates["usd_rub"]
+    btc_usd = rates["btc_usd"]
+
+    # Доход и расходы одного ASIC в день
+    constants = (
+        rates["daily_profit_usd"] * usd_rub,
+        (asic_power / 1000) * 24 * electricity,
+        params["asic_price"],
+        usd_rub,
+        btc_usd
+    )
+
+    # Сценарии раскладываются по месяцам один раз до начала расчета
+    table = compile_scenarios(scenarios)
+
+    state = {"asics": params["asic_count"], "savings": 0.0, "wallet_btc": 0.0}
+    columns = _ResultColumns()
+    for start, end, scenario in table.segments():
+        _simulate_segment(start, end, scenario, state, constants, columns)
+
+    data = columns.arrays()
+    if data is None:
+        df = pd.DataFrame(columns=["Месяц", "ASIC", *MONEY_COLUMNS[:-1], "wallet_btc", "wallet_value"])
+    else:
+        # Все денежные столбцы - в базовой валюте, без округления
+        df = pd.DataFrame({
+            "Месяц": data["month"].astype(np.int64),
+            "ASIC": data["asics"],
+            "Доходы": data["profit"] + data["cost"],
+            "Расходы": data["cost"],
+            "Прибыль": data["profit"],
+            "Зарплата": data["salary"],
+            "Реинвест": data["to_reinvest"],
+            "В кошелек": data["to_wallet"],
+            "Накопления": data["savings"],
+            "wallet_btc": data["wallet_btc"],
+            "wallet_value": data["wallet_btc"] * btc_usd * usd_rub
+        })
+    df.attrs["rates"] = {key: float(rates[key]) for key in RATE_FIELDS}
+    return df
+
+def currency_rate(currency, rates):
+    """Стоимость единицы валюты в базовой валюте"""
+    if currency == BASE_CURRENCY:
+        return 1.0
+    if currency == "usd":
+        return rates["usd_rub"]
+    if currency == "btc":
+        return rates["usd_rub"] * rates["btc_usd"]
+    raise ValueError(f"Неизвестная валюта: {currency}")
+
+def convert_currency(df, currency, rates):
+    """Денежные столбцы в выбранной валюте по снимку курсов расчета"""
+    if currency == BASE_CURRENCY:
+        return df
+    columns = [column for column in MONEY_COLUMNS if column in df.columns]
+    converted = df.copy()
+    converted[columns] = df[columns] / currency_rate(currency, rates)
+    return converted
+
+def summarize(df, params, rates):
+    """Сводные показатели расчета в базовой валюте"""
+    investment = params["asic_count"] * params["asic_price"] * rates["usd_rub"]
+    break_even = break_even_summary(df, investment)
+    return {
+        "initial_investment": float(investment),
+        "clean_break_even": break_even["clean"],
+        "dirty_break_even": break_even["dirty"],
+        "total_profit": float(df["Прибыль"].sum()),
+        "total_electricity": float(df["Расходы"].sum())
+    }
+
+def find_break_even(months, totals, investment):
+    """Первый месяц, в котором накопленный результат totals покрыл
+    investment. months - номера месяцев (с пропусками между сценариями),
+    totals - накопленная к концу месяца сумма. Возвращает месяц, дробный
+    месяц с линейной интерполяцией внутри него и число дней; все None,
+    если вложения не окупились"""
+    months = np.asarray(months, dtype=float)
+    totals = np.asarray(totals, dtype=float)
+    result = {"month": None, "fractional_month": None, "days": None}
+    if len(totals) == 0:
+        return result
+
+    # По накопленному максимуму, чтобы поиск работал и при убыточных месяцах
+    index = int(np.searchsorted(np.maximum.accumulate(totals), investment, side="left"))
+    if index == len(totals):
+        return result
+
+    previous = totals[index - 1] if index > 0 else 0.0
+    gained = totals[index] - previous
+    fraction = (investment - previous) / gained if gained > 0 else 1.0
+    fractional_month = months[index] - 1 + min(max(fraction, 0.0), 1.0)
+    result["month"] = int(months[index])
+    result["fractional_month"] = float(fractional_month)
+    result["days"] = int(math.ceil(fractional_month * DAYS_PER_MONTH))
+    return result
+
+def break_even_summary(df, investment):
+    """Чистая окупаемость - по зарплате и стоимости кошелька, грязная -
+    по накопленной прибыли"""
+    if df.empty:
+        empty = {"month": None, "fractional_month": None, "days": None}
+        return {"clean": empty, "dirty": dict(empty)}
+    months = df["Месяц"].to_numpy()
+    salary = df["Зарплата"].to_numpy(dtype=float)
+    profit = df["Прибыль"].to_numpy(dtype=float)
+    wallet_value = df["wallet_value"].to_numpy(dtype=float)
+    return {
+        "clean": find_break_even(months, np.cumsum(salary) + wallet_value, investment),
+        "dirty": find_break_even(months, np.cumsum(profit), investment)
+    }
+
+def simulate(params, scenarios, rates):
+    """Расчет с кэшем по хешу входных данных: повторный расчет той же
+    конфигурации возвращается сразу.
+
+    params - параметры оборудования (asic_count, asic_power, asic_price,
+    electricity), scenarios - список периодов с процентами реинвестиций и
+    кошелька, rates - курсы usd_rub, btc_usd и доход одного ASIC в день
+    daily_profit_usd. Денежные столбцы - в базовой валюте (рубли), снимок
+    курсов расчета - в df.attrs["rates"]."""
+    key = inputs_fingerprint(params, scenarios, rates)
+    with _simulation_lock:
+        cached = _simulation_cache.get(key)
+        if cached is not None:
+            _simulation_cache.move_to_end(key)
+            return cached.copy()
+
+    df = run_simulation(params, scenarios, rates)
+
+    with _simulation_lock:
+        _simulation_cache[key] = df
+        _simulation_cache.move_to_end(key)
+        while len(_simulation_cache) > SIMULATION_CACHE_SIZE:
+            _simulation_cache.popitem(last=False)
+    return df.copy()
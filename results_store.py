@@ -0,0 +1,287 @@
+import json
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from mining_engine import RATE_FIELDS, canonical_inputs, inputs_fingerprint, simulate
+
+# Способы хранения таблицы: сжатые столбцы или только входные данные
+# расчета, по которым таблица пересчитывается при открытии
+STORAGE_COLUMNS = "columns"
+STORAGE_INPUTS = "inputs"
+
+# Типы столбцов при хранении: счетчики - int32, деньги - float32,
+# биткоины - float64, чтобы не потерять сатоши
+COLUMN_DTYPES = {
+    "Месяц": np.int32,
+    "ASIC": np.int32,
+    "wallet_btc": np.float64
+}
+DEFAULT_DTYPE = np.float32
+COMPRESSION_LEVEL = 6
+
+# Параметры оборудования и итоги расчета, которые хранятся отдельными
+# столбцами таблицы runs, чтобы список сохранений не разбирал JSON
+RUN_PARAM_FIELDS = ("asic_count", "asic_hashrate", "asic_power", "asic_price", "electricity")
+RUN_SUMMARY_FIELDS = ("initial_investment", "total_profit", "total_electricity")
+
+# Поля, по которым список сохранений фильтруется и сортируется; у каждого
+# свой индекс в runs
+RUN_FILTER_FIELDS = (*RUN_PARAM_FIELDS, "clean_break_even", "dirty_break_even", "total_profit")
+RUN_SORT_FIELDS = ("timestamp", "name", *RUN_FILTER_FIELDS)
+
+def _storage_array(name, values):
+    """Столбец в типе хранения; значения, не влезающие в int32, хранятся шире"""
+    dtype = COLUMN_DTYPES.get(name, DEFAULT_DTYPE)
+    if values.dtype == object:
+        return values.astype(np.float64)
+    if np.issubdtype(dtype, np.integer) and len(values):
+        limits = np.iinfo(dtype)
+        if values.min() < limits.min or values.max() > limits.max:
+            dtype = np.int64
+    return np.ascontiguousarray(values.astype(dtype))
+
+def pack_results(df):
+    """Таблица результатов в компактном столбцовом виде: по массиву NumPy
+    фиксированного типа на столбец, каждый сжат zlib"""
+    columns = []
+    for name in df.columns:
+        array = _storage_array(name, df[name].to_numpy())
+        columns.append({
+            "name": name,
+            "dtype": array.dtype.str,
+            "data": zlib.compress(array.tobytes(), COMPRESSION_LEVEL)
+        })
+    return {
+        "mode": STORAGE_COLUMNS,
+        "rows": len(df),
+        "columns": columns,
+        "packed_bytes": sum(len(column["data"]) for column in columns),
+        "frame_bytes": int(df.memory_usage(index=False, deep=True).sum())
+    }
+
+def unpack_results(packed):
+    """DataFrame поверх распакованных буферов, без копирования столбцов"""
+    data = {
+        column["name"]: np.frombuffer(zlib.decompress(column["data"]), dtype=column["dtype"])
+        for column in packed["columns"]
+    }
+    return pd.DataFrame(data, copy=False)
+
+def pack_inputs(params, scenarios, rates):
+    """Сохранение без таблицы: канонические входные данные и их хеш.
+    Одинаковые конфигурации под разными названиями дают один хеш и один
+    результат в кэше расчетов"""
+    inputs = canonical_inputs(params, scenarios, rates)
+    return {
+        "mode": STORAGE_INPUTS,
+        "fingerprint": inputs_fingerprint(params, scenarios, rates),
+        "inputs": inputs,
+        "packed_bytes": len(json.dumps(inputs, separators=(",", ":")).encode("utf-8"))
+    }
+
+def store_results(df, params, scenarios, rates, mode=STORAGE_INPUTS):
+    """Упаковка результата расчета выбранным способом хранения"""
+    if mode == STORAGE_INPUTS:
+        return pack_inputs(params, scenarios, rates)
+    if mode == STORAGE_COLUMNS:
+        return pack_results(df)
+    raise ValueError(f"Неизвестный способ хранения: {mode}")
+
+def load_results(stored):
+    """Таблица сохранения: распаковка столбцов или пересчет через кэш расчетов"""
+    if stored["mode"] == STORAGE_INPUTS:
+        inputs = stored["inputs"]
+        return simulate(inputs["params"], inputs["scenarios"], inputs["rates"])
+    return unpack_results(stored)
+
+def describe_size(packed):
+    """Память сохранения: сжатые столбцы против исходной таблицы"""
+    if packed["mode"] == STORAGE_INPUTS:
+        return (
+            f"Хранятся только параметры ({packed['packed_bytes']} Б, "
+            f"хеш {packed['fingerprint'][:12]}), таблица пересчитывается при открытии"
+        )
+    return (
+        f"{packed['rows']} мес., хранится {packed['packed_bytes'] / 1024:.1f} КБ "
+        f"(таблица {packed['frame_bytes'] / 1024:.1f} КБ)"
+    )
+
+class SavedResultsStore:
+    """Сохраненные расчеты в SQLite в режиме WAL: общие для всех сессий и
+    процессов на хосте и переживают перезапуск. Метаданные расчета - в
+    индексируемой таблице runs, помесячные столбцы - в run_columns и
+    читаются только при открытии расчета"""
+
+    LIST_COLUMNS = (
+        "name", "timestamp", *RUN_PARAM_FIELDS, *RATE_FIELDS, *RUN_SUMMARY_FIELDS,
+        "clean_break_even", "dirty_break_even", "storage", "fingerprint", "packed_bytes"
+    )
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                timestamp TEXT NOT NULL,
+                {", ".join(f"{field} NUMERIC" for field in RUN_PARAM_FIELDS)},
+                {", ".join(f"{field} REAL" for field in RATE_FIELDS)},
+                {", ".join(f"{field} REAL" for field in RUN_SUMMARY_FIELDS)},
+                clean_break_even INTEGER,
+                dirty_break_even INTEGER,
+                storage TEXT NOT NULL,
+                fingerprint TEXT,
+                rows INTEGER,
+                packed_bytes INTEGER NOT NULL,
+                frame_bytes INTEGER,
+                params_json TEXT NOT NULL,
+                summary_json TEXT NOT NULL,
+                inputs_json TEXT
+            );
+            CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+            CREATE INDEX IF NOT EXISTS runs_fingerprint ON runs (fingerprint);
+            {"".join(f"CREATE INDEX IF NOT EXISTS runs_{field} ON runs ({field});"
+                     for field in RUN_FILTER_FIELDS)}
+            CREATE TABLE IF NOT EXISTS run_columns (
+                run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                dtype TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (run_id, position)
+            );
+        """)
+
+    def save(self, name, timestamp, params, rates, summary, stored):
+        """Новое сохранение; False, если название уже занято"""
+        values = {
+            "name": name,
+            "timestamp": timestamp,
+            **{field: params[field] for field in RUN_PARAM_FIELDS},
+            **{field: rates[field] for field in RATE_FIELDS},
+            **{field: summary[field] for field in RUN_SUMMARY_FIELDS},
+            "clean_break_even": summary["clean_break_even"]["month"],
+            "dirty_break_even": summary["dirty_break_even"]["month"],
+            "storage": stored["mode"],
+            "fingerprint": stored.get("fingerprint"),
+            "rows": stored.get("rows"),
+            "packed_bytes": stored["packed_bytes"],
+            "frame_bytes": stored.get("frame_bytes"),
+            "params_json": json.dumps(params, ensure_ascii=False),
+            "summary_json": json.dumps(summary),
+            "inputs_json": json.dumps(stored["inputs"]) if "inputs" in stored else None
+        }
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute(
+                    f"INSERT INTO runs ({', '.join(values)}) "
+                    f"VALUES ({', '.join('?' * len(values))}) "
+                    "ON CONFLICT (name) DO NOTHING",
+                    tuple(values.values())
+                )
+                if cursor.rowcount:
+                    self.conn.executemany(
+                        "INSERT INTO run_columns (run_id, position, name, dtype, data) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (cursor.lastrowid, position, column["name"], column["dtype"], column["data"])
+                            for position, column in enumerate(stored.get("columns", []))
+                        ]
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return bool(cursor.rowcount)
+
+    @staticmethod
+    def where_clause(filters):
+        """Условие WHERE и его параметры по фильтрам {поле: (от, до)};
+        None в границе - без ограничения. Расчеты без окупаемости не
+        проходят ни одну границу по ее сроку"""
+        conditions = []
+        values = []
+        for field, (low, high) in (filters or {}).items():
+            if field not in RUN_FILTER_FIELDS:
+                raise ValueError(f"Неизвестное поле фильтра: {field}")
+            if low is not None:
+                conditions.append(f"{field} >= ?")
+                values.append(low)
+            if high is not None:
+                conditions.append(f"{field} <= ?")
+                values.append(high)
+        if not conditions:
+            return "", ()
+        return "WHERE " + " AND ".join(conditions), tuple(values)
+
+    def count(self, filters=None):
+        where, values = self.where_clause(filters)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM runs {where}", values).fetchone()[0]
+
+    def list(self, limit, offset=0, filters=None, order_by="timestamp", descending=True):
+        """Страница списка сохранений по фильтрам и сортировке, без
+        помесячных данных. Пустые значения (нет окупаемости) - в конце"""
+        if order_by not in RUN_SORT_FIELDS:
+            raise ValueError(f"Неизвестное поле сортировки: {order_by}")
+        where, values = self.where_clause(filters)
+        direction = "DESC" if descending else "ASC"
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.LIST_COLUMNS)} FROM runs {where} "
+                f"ORDER BY {order_by} IS NULL, {order_by} {direction}, id DESC "
+                "LIMIT ? OFFSET ?",
+                (*values, limit, offset)
+            ).fetchall()
+        return [dict(zip(self.LIST_COLUMNS, row)) for row in rows]
+
+    def load(self, name):
+        """Сохранение целиком в том же виде, в каком оно было сохранено"""
+        with self.lock:
+            run = self.conn.execute(
+                "SELECT id, timestamp, storage, fingerprint, rows, packed_bytes, frame_bytes, "
+                f"params_json, summary_json, inputs_json, {', '.join(RATE_FIELDS)} "
+                "FROM runs WHERE name = ?",
+                (name,)
+            ).fetchone()
+            if run is None:
+                return None
+            columns = self.conn.execute(
+                "SELECT name, dtype, data FROM run_columns WHERE run_id = ? ORDER BY position",
+                (run[0],)
+            ).fetchall()
+        (_, timestamp, storage, fingerprint, rows, packed_bytes, frame_bytes,
+         params_json, summary_json, inputs_json) = run[:10]
+        if storage == STORAGE_INPUTS:
+            stored = {"mode": storage, "fingerprint": fingerprint,
+                      "inputs": json.loads(inputs_json), "packed_bytes": packed_bytes}
+        else:
+            stored = {
+                "mode": storage,
+                "rows": rows,
+                "columns": [{"name": column, "dtype": dtype, "data": data}
+                            for column, dtype, data in columns],
+                "packed_bytes": packed_bytes,
+                "frame_bytes": frame_bytes
+            }
+        return {
+            "timestamp": timestamp,
+            "data": stored,
+            "summary": json.loads(summary_json),
+            "params": json.loads(params_json),
+            "rates": dict(zip(RATE_FIELDS, run[10:]))
+        }
+
+    def delete(self, name):
+        with self.lock:
+            self.conn.execute("DELETE FROM runs WHERE name = ?", (name,))
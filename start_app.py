@@ -1,40 +1,135 @@
 import streamlit as st
 import pandas as pd
 import requests
+import json
+import os
+import random
+import sqlite3
+import threading
 import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime
+from functools import partial
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+from formatting import (CURRENCY_DECIMALS, CURRENCY_LABELS, add_wallet_column, format_columns,
+                        format_number)
+from mining_engine import (MONEY_COLUMNS, ScenarioError, compile_scenarios, convert_currency,
+                           currency_rate, simulate, summarize)
+from results_store import (RUN_FILTER_FIELDS, RUN_SORT_FIELDS, STORAGE_COLUMNS, STORAGE_INPUTS,
+                           SavedResultsStore, describe_size, load_results, store_results)
 
 # Настройки API
 API_CONFIG = {
     "coingecko": {
         "url": "https://api.coingecko.com/api/v3",
-        "rate_limit": 10
+        "rate_limit": 10,
+        "timeout": 5
     },
     "binance": {
         "url": "https://api.binance.com/api/v3",
-        "rate_limit": 1200
+        "rate_limit": 1200,
+        "timeout": 3
     },
     "blockchain": {
         "url": "https://blockchain.info/ticker",
-        "rate_limit": 60
+        "rate_limit": 60,
+        "timeout": 5
     },
     "cbr": {
         "url": "https://www.cbr-xml-daily.ru/latest.js",
-        "rate_limit": 60
+        "rate_limit": 60,
+        "timeout": 5
+    },
+    "whattomine": {
+        "url": "https://whattomine.com/coins/1.json",
+        "rate_limit": 60,
+        "timeout": 10
     }
 }
 
-# Глобальный кэш для хранения данных
-API_CACHE = {
-    "btc_price": {"value": None, "timestamp": None, "expires": 300},
-    "usd_rub": {"value": None, "timestamp": None, "expires": 3600},
-    "mining_data": {"value": None, "timestamp": None, "expires": 600}
+# Настройки хеджированных запросов: через сколько секунд без ответа
+# отправлять запрос к следующему источнику (0 - ко всем сразу)
+HEDGE_DELAY = 0.3
+FETCH_TIMEOUT = 5
+# Сколько секунд всего ждать ответа от всех источников одного запроса
+FETCH_DEADLINE = 10
+# Сколько секунд ждать чужую загрузку того же ключа кэша
+REFRESH_WAIT_TIMEOUT = 15
+
+# Автомат отключения источников: сколько ошибок подряд размыкает цепь,
+# через сколько секунд пробуем снова и сколько последних запросов
+# учитывается в статистике
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+HEALTH_WINDOW = 100
+
+# Настройки пула соединений: число хостов и соединений на хост
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 16
+
+# Настройки общего кэша: время жизни и число записей для каждого ключа.
+# Данные майнинга хранятся отдельно для каждой конфигурации оборудования
+CACHE_CONFIG = {
+    "btc_price": {"expires": 300, "capacity": 1},
+    "usd_rub": {"expires": 3600, "capacity": 1},
+    "mining_data": {"expires": 600, "capacity": 64}
 }
 
-# Инициализация session_state
-if 'saved_results' not in st.session_state:
-    st.session_state.saved_results = {}
+# Файл постоянного кэша API, общий для процессов на одном хосте
+# (пустая строка - кэш только в памяти)
+CACHE_DB_PATH = os.environ.get("START_APP_CACHE_DB", "api_cache.db")
+
+# Фоновое обновление курсов: за сколько секунд до истечения кэша
+# обновлять значение, как часто проверять и пауза после неудачи
+RATE_REFRESH_LEAD = 30
+RATE_REFRESH_POLL = 5
+RATE_RETRY_DELAY = 30
+# Сколько секунд ждать завершения фонового потока при его остановке
+RATE_REFRESHER_JOIN_TIMEOUT = 10
+
+# Курсы на странице: сколько секунд сессия переиспользует свой снимок
+# курсов без обращения к кэшу и сколько ждет загрузку при холодном старте
+RATES_SNAPSHOT_TTL = 30
+RATES_DEADLINE = 2
+
+# Повторные запросы whattomine: экспоненциальная пауза с джиттером
+# и сколько секунд расчет ждет данные, прежде чем взять резервные
+MINING_RETRY_BASE_DELAY = 1
+MINING_RETRY_MAX_DELAY = 8
+MINING_DATA_DEADLINE = 5
+
+# Сколько сохранений показывать на одной странице списка
+SAVED_RESULTS_PAGE_SIZE = 30
+
+# Как хранить таблицы сохранений: "inputs" - только параметры расчета,
+# таблица пересчитывается при открытии; "columns" - сжатые столбцы
+SAVED_RESULTS_STORAGE = os.environ.get("START_APP_SAVED_STORAGE", STORAGE_INPUTS)
+if SAVED_RESULTS_STORAGE not in (STORAGE_INPUTS, STORAGE_COLUMNS):
+    SAVED_RESULTS_STORAGE = STORAGE_INPUTS
+
+# Файл базы сохраненных расчетов, общей для всех сессий
+SAVED_RESULTS_DB_PATH = os.environ.get("START_APP_RESULTS_DB", "saved_results.db")
+
+# Подписи полей фильтра и сортировки сохранений
+SAVED_RESULTS_FIELD_LABELS = {
+    "timestamp": "Дата сохранения",
+    "name": "Название",
+    "asic_count": "Количество ASIC",
+    "asic_hashrate": "Хешрейт, TH/s",
+    "asic_power": "Потребление, Вт",
+    "asic_price": "Стоимость ASIC, $",
+    "electricity": "Электричество, ₽/кВт·ч",
+    "clean_break_even": "Окупаемость чистая, мес",
+    "dirty_break_even": "Окупаемость грязная, мес",
+    "total_profit": "Прибыль, ₽"
+}
 
+# Инициализация session_state
 if 'current_results' not in st.session_state:
     st.session_state.current_results = None
 
@@ -42,118 +137,925 @@ if 'scenarios' not in st.session_state:
     st.session_state.scenarios = []
 
 # --- Функции для работы с API ---
-def get_cached_data(key):
-    """Получаем данные из кэша если они актуальны"""
-    if API_CACHE[key]["value"] and API_CACHE[key]["timestamp"]:
-        elapsed = time.time() - API_CACHE[key]["timestamp"]
-        if elapsed < API_CACHE[key]["expires"]:
-            return API_CACHE[key]["value"]
-    return None
+class HttpClient:
+    """HTTP-клиент с keep-alive пулами соединений для каждого хоста"""
+
+    def __init__(self, config, pool_connections=HTTP_POOL_CONNECTIONS,
+                 pool_maxsize=HTTP_POOL_MAXSIZE):
+        self.config = config
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.providers = {
+            urlparse(provider["url"]).netloc: name
+            for name, provider in config.items()
+        }
+
+    def provider_for(self, url):
+        """Имя провайдера из API_CONFIG по адресу запроса"""
+        return self.providers.get(urlparse(url).netloc)
+
+    def timeout_for(self, url):
+        """Таймаут провайдера из API_CONFIG"""
+        provider = self.config.get(self.provider_for(url), {})
+        return provider.get("timeout", FETCH_TIMEOUT)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout_for(url))
+        return self.session.get(url, **kwargs)
+
+    def stats(self):
+        """Статистика переиспользования соединений по хостам"""
+        pools = self.adapter.poolmanager.pools
+        rows = []
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            rows.append({
+                "Хост": pool.host,
+                "Провайдер": self.providers.get(pool.host, "-"),
+                "Запросы": pool.num_requests,
+                "Соединения": pool.num_connections,
+                "Переиспользовано": max(pool.num_requests - pool.num_connections, 0)
+            })
+        return rows
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate_limit запросов в минуту"""
+
+    def __init__(self, rate_limit, period=60):
+        self.capacity = float(rate_limit)
+        self.fill_rate = rate_limit / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.shed = 0
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Забираем токен; если корзина пуста - запрос сбрасывается"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.shed += 1
+            return False
+
+    def stats(self):
+        with self.lock:
+            self._refill()
+            return {"tokens": self.tokens, "shed": self.shed}
+
+class RateLimiters:
+    """Token bucket для каждого провайдера по rate_limit из API_CONFIG"""
+
+    def __init__(self, config):
+        self.buckets = {
+            name: TokenBucket(provider["rate_limit"])
+            for name, provider in config.items()
+            if provider.get("rate_limit")
+        }
+
+    def try_acquire(self, provider):
+        bucket = self.buckets.get(provider)
+        return bucket is None or bucket.try_acquire()
+
+    def stats(self):
+        rows = []
+        for name, bucket in self.buckets.items():
+            bucket_stats = bucket.stats()
+            rows.append({
+                "Провайдер": name,
+                "Лимит/мин": int(bucket.capacity),
+                "Доступно": int(bucket_stats["tokens"]),
+                "Сброшено": bucket_stats["shed"]
+            })
+        return rows
+
+@st.cache_resource
+def get_rate_limiters():
+    """Лимитеры запросов, общие для всех сессий процесса"""
+    return RateLimiters(API_CONFIG)
+
+class ProviderHealth:
+    """Автомат отключения (closed/open/half_open) и скользящая статистика
+    задержек и ошибок одного провайдера"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, window=HEALTH_WINDOW):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.opened_at = 0
+        self.probe_started = None
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.errors = 0
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Можно ли отправить запрос; в half_open пропускаем одну пробу"""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self.probe_started = None
+            # Зависшую или отмененную пробу повторяем после reset_timeout
+            if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+                return False
+            self.probe_started = now
+            return True
+
+    def release_probe(self):
+        """Возвращаем пробу, разрешенную allow_request, но не отправленную"""
+        with self.lock:
+            if self.state == "half_open":
+                self.probe_started = None
+
+    def record(self, ok, latency):
+        with self.lock:
+            self.samples.append((ok, latency))
+            if ok:
+                self.successes += 1
+                self.consecutive_failures = 0
+                self.state = "closed"
+                self.probe_started = None
+                return
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def _latencies(self):
+        return sorted(latency for ok, latency in self.samples if ok)
+
+    @staticmethod
+    def _percentile(values, percent):
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+        return values[index]
+
+    def score(self):
+        """Ключ сортировки: отключенные в конце, затем по доле успешных
+        запросов и медианной задержке. Без статистики провайдер считается
+        безошибочным с неизвестной задержкой: идет после проверенных без
+        ошибок, но раньше ошибавшихся, чтобы быстрее набрать статистику"""
+        with self.lock:
+            if not self.samples:
+                return (self.state == "open", -1.0, float("inf"))
+            success_rate = sum(ok for ok, _ in self.samples) / len(self.samples)
+            p50 = self._percentile(self._latencies(), 50)
+            return (self.state == "open", -success_rate, p50 if p50 is not None else float("inf"))
+
+    def stats(self):
+        with self.lock:
+            latencies = self._latencies()
+            total = len(self.samples)
+            return {
+                "state": self.state,
+                "success_rate": sum(ok for ok, _ in self.samples) / total if total else None,
+                "p50": self._percentile(latencies, 50),
+                "p95": self._percentile(latencies, 95),
+                "successes": self.successes,
+                "errors": self.errors,
+                "consecutive_failures": self.consecutive_failures
+            }
+
+class ProviderHealthRegistry:
+    """Состояние провайдеров из API_CONFIG и их порядок опроса"""
+
+    def __init__(self, config):
+        self.providers = {name: ProviderHealth() for name in config}
+
+    def allow_request(self, provider):
+        health = self.providers.get(provider)
+        return health is None or health.allow_request()
+
+    def release_probe(self, provider):
+        health = self.providers.get(provider)
+        if health is not None:
+            health.release_probe()
+
+    def record(self, provider, ok, latency):
+        health = self.providers.get(provider)
+        if health is not None:
+            health.record(ok, latency)
+
+    def order(self, sources, provider_for):
+        """Источники по убыванию надежности, при равенстве - в исходном порядке"""
+        def score(source):
+            health = self.providers.get(provider_for(source[0]))
+            return health.score() if health is not None else (False, -1.0, float("inf"))
+        return sorted(sources, key=score)
+
+    def table(self):
+        rows = []
+        for name, health in self.providers.items():
+            stats = health.stats()
+            rows.append({
+                "Провайдер": name,
+                "Состояние": stats["state"],
+                "Успешно %": None if stats["success_rate"] is None else round(stats["success_rate"] * 100),
+                "p50, мс": None if stats["p50"] is None else round(stats["p50"] * 1000),
+                "p95, мс": None if stats["p95"] is None else round(stats["p95"] * 1000),
+                "Успехи": stats["successes"],
+                "Ошибки": stats["errors"],
+                "Ошибок подряд": stats["consecutive_failures"]
+            })
+        return rows
+
+@st.cache_resource
+def get_provider_health():
+    """Состояние провайдеров, общее для всех сессий процесса"""
+    return ProviderHealthRegistry(API_CONFIG)
+
+@st.cache_resource
+def get_http_client():
+    """Один HTTP-клиент на процесс сервера, общий для сессий и перезапусков"""
+    return HttpClient(API_CONFIG)
+
+@st.cache_resource
+def get_fetch_executor():
+    """Общий для всех сессий пул потоков для запросов к API"""
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="api-fetch")
+
+@st.cache_resource
+def get_refresh_executor():
+    """Пул для фоновых обновлений кэша. Отдельный от пула запросов:
+    обновление ждет запросы, которые отправляет в get_fetch_executor, и
+    в общем пуле такие ожидания могли бы занять все потоки"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="api-refresh")
+
+def fetch_one(client, health, url, parse_func):
+    """Запрос к одному источнику, None при любой ошибке"""
+    provider = client.provider_for(url)
+    started = time.monotonic()
+    try:
+        response = client.get(url)
+        response.raise_for_status()
+        data = parse_func(response.json())
+    except Exception:
+        data = None
+    health.record(provider, data is not None, time.monotonic() - started)
+    return data
 
-def set_cached_data(key, value):
-    """Обновляем данные в кэше"""
-    API_CACHE[key]["value"] = value
-    API_CACHE[key]["timestamp"] = time.time()
+class LRUTTLCache:
+    """Ограниченный LRU-кэш, у каждой записи свое время жизни"""
 
-def fetch_with_fallback(urls, parse_funcs):
-    """Пытаемся получить данные из нескольких источников"""
-    for url, parse_func in zip(urls, parse_funcs):
+    def __init__(self, capacity, expires):
+        self.capacity = capacity
+        self.expires = expires
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count=True):
+        """Актуальное значение по ключу или None. count=False - обращение
+        не учитывается в статистике, его учтет вызывающий через record_lookup"""
+        with self.lock:
+            entry = self.entries.get(key)
+            hit = entry is not None and time.time() - entry[1] < self.expires
+            if hit:
+                self.entries.move_to_end(key)
+            if count:
+                self._count(hit)
+            return entry[0] if hit else None
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def record_lookup(self, hit):
+        with self.lock:
+            self._count(hit)
+
+    def get_entry(self, key):
+        """Последнее значение и время его получения, даже если устарело"""
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, value, timestamp=None):
+        with self.lock:
+            self.entries[key] = (value, timestamp or time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+class SqliteCacheBackend:
+    """Постоянное хранилище кэша в SQLite в режиме WAL: переживает
+    перезапуск и доступно нескольким процессам Streamlit на хосте. Как и
+    LRU в памяти, хранит не больше capacities[key] записей каждого ключа"""
+
+    def __init__(self, path, capacities):
+        self.capacities = capacities
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT NOT NULL,
+                subkey TEXT NOT NULL,
+                value TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                PRIMARY KEY (key, subkey)
+            )
+        """)
+
+    @staticmethod
+    def encode_subkey(subkey):
+        return json.dumps(subkey)
+
+    @staticmethod
+    def decode_subkey(subkey):
+        subkey = json.loads(subkey)
+        return tuple(subkey) if isinstance(subkey, list) else subkey
+
+    def _prune_key(self, key):
+        # Устаревшие записи не удаляем: они нужны как последнее известное
+        # значение, когда источники недоступны; вытесняем самые старые сверх capacity
+        self.conn.execute("""
+            DELETE FROM cache_entries WHERE key = ? AND subkey NOT IN (
+                SELECT subkey FROM cache_entries WHERE key = ?
+                ORDER BY timestamp DESC LIMIT ?
+            )
+        """, (key, key, self.capacities[key]))
+
+    def prune(self):
+        """Удаляем записи сверх capacity и записи неизвестных ключей"""
+        with self.lock:
+            self.conn.execute(
+                f"DELETE FROM cache_entries WHERE key NOT IN ({', '.join('?' * len(self.capacities))})",
+                tuple(self.capacities)
+            )
+            for key in self.capacities:
+                self._prune_key(key)
+
+    def load(self):
+        """Все записи в порядке получения: (key, subkey, value, timestamp)"""
+        self.prune()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, subkey, value, timestamp FROM cache_entries ORDER BY timestamp"
+            ).fetchall()
+        return [
+            (key, self.decode_subkey(subkey), json.loads(value), timestamp)
+            for key, subkey, value, timestamp in rows
+        ]
+
+    def get(self, key, subkey):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, timestamp FROM cache_entries WHERE key = ? AND subkey = ?",
+                (key, self.encode_subkey(subkey))
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, subkey, value, timestamp):
+        # Более старое значение не перезаписывает свежее из другого процесса
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO cache_entries (key, subkey, value, timestamp)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (key, subkey) DO UPDATE
+                SET value = excluded.value, timestamp = excluded.timestamp
+                WHERE excluded.timestamp > cache_entries.timestamp
+            """, (key, self.encode_subkey(subkey), json.dumps(value), timestamp))
+            self._prune_key(key)
+
+class SharedCache:
+    """Потокобезопасный кэш по ключам CACHE_CONFIG. Одновременные
+    обновления одного ключа объединяются: загружает только один поток,
+    остальные получают устаревшее значение или ждут результата"""
+
+    def __init__(self, config, backend=None, wait_timeout=REFRESH_WAIT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self.stores = {
+            key: LRUTTLCache(settings["capacity"], settings["expires"])
+            for key, settings in config.items()
+        }
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.backend = backend
+        if backend is not None:
+            # Восстанавливаем записи с исходным временем, чтобы TTL продолжали действовать
+            for key, subkey, value, timestamp in backend.load():
+                if key in self.stores:
+                    self.stores[key].set(subkey, value, timestamp)
+
+    def sync(self, key, subkey=None):
+        """Подтягиваем более свежее значение, записанное другим процессом"""
+        if self.backend is None:
+            return False
+        try:
+            row = self.backend.get(key, subkey)
+        except sqlite3.Error:
+            return False
+        entry = self.stores[key].get_entry(subkey)
+        if row is None or (entry is not None and row[1] <= entry[1]):
+            return False
+        self.stores[key].set(subkey, row[0], row[1])
+        return True
+
+    def is_fresh(self, key, entry):
+        return entry is not None and time.time() - entry[1] < self.stores[key].expires
+
+    def get(self, key, subkey=None):
+        """Актуальное значение или None. Обращение учитывается в статистике
+        один раз, даже если значение пришлось подтянуть из другого процесса"""
+        store = self.stores[key]
+        value = store.get(subkey, count=False)
+        if value is None and self.sync(key, subkey):
+            value = store.get(subkey, count=False)
+        store.record_lookup(value is not None)
+        return value
+
+    def get_entry(self, key, subkey=None):
+        """Последнее значение и время его получения, даже если устарело"""
+        entry = self.stores[key].get_entry(subkey)
+        if not self.is_fresh(key, entry) and self.sync(key, subkey):
+            entry = self.stores[key].get_entry(subkey)
+        return entry
+
+    def set(self, key, value, subkey=None, timestamp=None):
+        timestamp = timestamp or time.time()
+        self.stores[key].set(subkey, value, timestamp)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, subkey, value, timestamp)
+            except sqlite3.Error:
+                pass
+
+    def _start_flight(self, key, subkey):
+        """Текущая загрузка ключа и признак, что ее начали мы"""
+        with self.lock:
+            flight = self.in_flight.get((key, subkey))
+            if flight is not None:
+                return flight, False
+            flight = self.in_flight[(key, subkey)] = Future()
+            return flight, True
+
+    def _end_flight(self, key, subkey):
+        with self.lock:
+            del self.in_flight[(key, subkey)]
+
+    def _run_flight(self, flight, key, loader, subkey):
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key, value, subkey)
+            else:
+                entry = self.get_entry(key, subkey)
+                value = entry[0] if entry else None
+        except BaseException as error:
+            self._end_flight(key, subkey)
+            flight.set_exception(error)
+            raise
+        self._end_flight(key, subkey)
+        flight.set_result(value)
+        return value
+
+    def refresh(self, key, loader, subkey=None, wait_for_result=False):
+        """Загружаем новое значение через loader (None - неудача).
+        При неудаче возвращается последнее известное значение. Чужую
+        загрузку ждем не дольше wait_timeout"""
+        flight, is_leader = self._start_flight(key, subkey)
+        if is_leader:
+            return self._run_flight(flight, key, loader, subkey)
+        entry = self.get_entry(key, subkey)
+        if entry is None or wait_for_result:
+            wait((flight,), timeout=self.wait_timeout)
+            entry = self.get_entry(key, subkey)
+        return entry[0] if entry else None
+
+    def refresh_async(self, executor, key, loader, subkey=None):
+        """Обновление в пуле executor. Если ключ уже обновляется, новая
+        задача не ставится - возвращается Future идущей загрузки"""
+        flight, is_leader = self._start_flight(key, subkey)
+        if is_leader:
+            try:
+                executor.submit(self._run_flight, flight, key, loader, subkey)
+            except BaseException as error:
+                self._end_flight(key, subkey)
+                flight.set_exception(error)
+                raise
+        return flight
+
+    def wait_refresh(self, key, subkey=None):
+        """Дожидаемся идущей загрузки ключа, если она есть"""
+        with self.lock:
+            flight = self.in_flight.get((key, subkey))
+        if flight is not None:
+            wait((flight,), timeout=self.wait_timeout)
+
+    def stats(self, key):
+        return self.stores[key].stats()
+
+@st.cache_resource
+def get_shared_cache():
+    """Кэш данных API, общий для всех сессий процесса"""
+    backend = None
+    if CACHE_DB_PATH:
         try:
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            if response.status_code == 200:
-                data = parse_func(response.json())
+            backend = SqliteCacheBackend(
+                CACHE_DB_PATH,
+                {key: settings["capacity"] for key, settings in CACHE_CONFIG.items()}
+            )
+        except sqlite3.Error:
+            backend = None
+    return SharedCache(CACHE_CONFIG, backend)
+
+class ApiServices:
+    """Зависимости запросов к API, собранные один раз на процесс. Пул и
+    фоновый поток получают их явно: у этих потоков нет ScriptRunContext,
+    и геттеры st.cache_resource из них вызывать нельзя"""
+
+    def __init__(self, client, limiters, health, cache, executor, refresh_executor):
+        self.client = client
+        self.limiters = limiters
+        self.health = health
+        self.cache = cache
+        self.executor = executor
+        self.refresh_executor = refresh_executor
+
+@st.cache_resource
+def get_api_services():
+    """Зависимости API для загрузчиков, общие для всех сессий процесса"""
+    return ApiServices(get_http_client(), get_rate_limiters(), get_provider_health(),
+                       get_shared_cache(), get_fetch_executor(), get_refresh_executor())
+
+@st.cache_resource
+def get_saved_results_store():
+    """База сохраненных расчетов, общая для всех сессий процесса"""
+    return SavedResultsStore(SAVED_RESULTS_DB_PATH)
+
+def mining_data_key(hashrate_th, power_w, electricity_cost_usd):
+    """Нормализованный ключ запроса к whattomine"""
+    return (
+        round(float(hashrate_th), 3),
+        round(float(power_w), 1),
+        round(float(electricity_cost_usd), 6)
+    )
+
+def fetch_with_fallback(api, urls, parse_funcs, hedge_delay=HEDGE_DELAY, deadline=FETCH_DEADLINE):
+    """Опрашиваем источники с хеджированием: следующий запрос уходит,
+    если предыдущие не ответили за hedge_delay, побеждает первый
+    успешно разобранный ответ. Источники опрашиваются в порядке их
+    надежности, отключенные автоматом пропускаются. Дольше deadline
+    секунд не ждем: зависшие запросы не держат вызывающего"""
+    client = api.client
+    limiters = api.limiters
+    health = api.health
+    executor = api.executor
+    pending = set()
+    providers = {}
+    give_up_at = time.monotonic() + deadline
+    sources = iter(health.order(zip(urls, parse_funcs), client.provider_for))
+    exhausted = False
+    try:
+        while True:
+            if not exhausted:
+                source = next(sources, None)
+                if source is None:
+                    exhausted = True
+                    continue
+                provider = client.provider_for(source[0])
+                if not health.allow_request(provider):
+                    # Провайдер отключен автоматом - сразу переходим к следующему
+                    continue
+                if not limiters.try_acquire(provider):
+                    # Лимит провайдера исчерпан - возвращаем пробу автомата,
+                    # если она досталась этому запросу, и идем к следующему
+                    health.release_probe(provider)
+                    continue
+                future = executor.submit(fetch_one, client, health, *source)
+                providers[future] = provider
+                pending.add(future)
+            remaining = give_up_at - time.monotonic()
+            if not pending or remaining <= 0:
+                return None
+            done, pending = wait(
+                pending,
+                timeout=remaining if exhausted else min(hedge_delay, remaining),
+                return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                data = future.result()
                 if data is not None:
                     return data
-        except:
-            continue
-    return None
+    finally:
+        # Проигравшие запросы отменяем; уже выполняющиеся завершатся
+        # по таймауту, их результат просто игнорируется. Отмененная до
+        # отправки проба автомата возвращается
+        for future in pending:
+            if future.cancel():
+                health.release_probe(providers[future])
 
-def get_btc_price():
-    """Получаем курс BTC с нескольких бирж"""
-    cached = get_cached_data("btc_price")
-    if cached:
-        return cached
-    
+# Один запрос к CoinGecko отдает и цену BTC, и курс USD/RUB
+COINGECKO_QUOTES_URL = f"{API_CONFIG['coingecko']['url']}/simple/price?ids=bitcoin&vs_currencies=usd,rub"
+
+def parse_coingecko_quotes(data):
+    """Курсы из пакетного ответа CoinGecko"""
+    btc_usd = data["bitcoin"]["usd"]
+    return {
+        "btc_price": btc_usd,
+        "usd_rub": data["bitcoin"]["rub"] / btc_usd
+    }
+
+def store_quotes(cache, quotes, key):
+    """Кладем в кэш попутно полученные курсы и возвращаем запрошенный"""
+    if quotes is None:
+        return None
+    for other_key, value in quotes.items():
+        if other_key != key and value is not None:
+            cache.set(other_key, value)
+    return quotes.get(key)
+
+def load_btc_price(api):
+    """Запрашиваем курс BTC с нескольких бирж"""
     sources = [
-        f"{API_CONFIG['coingecko']['url']}/simple/price?ids=bitcoin&vs_currencies=usd",
+        COINGECKO_QUOTES_URL,
         f"{API_CONFIG['binance']['url']}/ticker/price?symbol=BTCUSDT",
         API_CONFIG['blockchain']['url']
     ]
     
     parse_funcs = [
-        lambda x: x["bitcoin"]["usd"],
-        lambda x: float(x["price"]),
-        lambda x: x["USD"]["last"]
+        parse_coingecko_quotes,
+        lambda x: {"btc_price": float(x["price"])},
+        lambda x: {"btc_price": x["USD"]["last"]}
     ]
     
-    price = fetch_with_fallback(sources, parse_funcs)
-    
-    if price is None and API_CACHE["btc_price"]["value"]:
-        return API_CACHE["btc_price"]["value"]
-    
-    price = price or 50000
-    set_cached_data("btc_price", price)
-    return price
-
-def get_usd_rub_rate():
-    """Получаем курс USD/RUB с нескольких источников"""
-    cached = get_cached_data("usd_rub")
-    if cached:
-        return cached
-    
+    return store_quotes(api.cache, fetch_with_fallback(api, sources, parse_funcs), "btc_price")
+
+def load_usd_rub_rate(api):
+    """Запрашиваем курс USD/RUB с нескольких источников"""
     sources = [
-        f"{API_CONFIG['coingecko']['url']}/simple/price?ids=bitcoin&vs_currencies=usd,rub",
+        COINGECKO_QUOTES_URL,
         API_CONFIG['cbr']['url'],
         f"{API_CONFIG['binance']['url']}/ticker/price?symbol=USDTRUB"
     ]
     
     parse_funcs = [
-        lambda x: x["bitcoin"]["rub"] / x["bitcoin"]["usd"],
-        lambda x: 1 / x["rates"]["USD"],
-        lambda x: float(x["price"])
+        parse_coingecko_quotes,
+        lambda x: {"usd_rub": 1 / x["rates"]["USD"]},
+        lambda x: {"usd_rub": float(x["price"])}
     ]
     
-    rate = fetch_with_fallback(sources, parse_funcs)
-    
-    if rate is None and API_CACHE["usd_rub"]["value"]:
-        return API_CACHE["usd_rub"]["value"]
-    
-    rate = rate or 90
-    set_cached_data("usd_rub", rate)
-    return rate
-
-def get_mining_data_with_retry(hashrate_th, power_w, electricity_cost_usd, retries=3):
-    """Получаем данные о майнинге с повторными попытками"""
-    cached = get_cached_data("mining_data")
-    if cached:
-        return cached
-    
+    return store_quotes(api.cache, fetch_with_fallback(api, sources, parse_funcs), "usd_rub")
+
+# Загрузчики (принимают ApiServices) и значения по умолчанию для курсов
+RATE_SOURCES = {
+    "btc_price": {"loader": load_btc_price, "default": 50000},
+    "usd_rub": {"loader": load_usd_rub_rate, "default": 90}
+}
+
+def load_rate(api, key):
+    """Загрузчик курса для кэша. Пакетный ответ CoinGecko приносит все
+    курсы сразу, поэтому сначала дожидаемся идущих загрузок курсов, стоящих
+    в RATE_SOURCES раньше. Если они уже принесли key, в сеть не идем:
+    None оставляет в кэше только что полученное значение"""
+    started = time.time()
+    for other_key in RATE_SOURCES:
+        if other_key == key:
+            break
+        api.cache.wait_refresh(other_key)
+    entry = api.cache.get_entry(key)
+    if entry is not None and entry[1] >= started:
+        return None
+    return RATE_SOURCES[key]["loader"](api)
+
+class RateRefresher:
+    """Фоновый поток, обновляющий курсы незадолго до истечения кэша.
+    Поток держит только слабую ссылку на объект: когда st.cache_resource
+    его забывает (очистка кэша, перезагрузка модуля), поток останавливается"""
+
+    def __init__(self, cache, loaders, lead=RATE_REFRESH_LEAD,
+                 poll=RATE_REFRESH_POLL, retry_delay=RATE_RETRY_DELAY,
+                 join_timeout=RATE_REFRESHER_JOIN_TIMEOUT):
+        self.cache = cache
+        self.loaders = loaders
+        self.lead = lead
+        self.poll = poll
+        self.retry_delay = retry_delay
+        self.next_attempt = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=RateRefresher.run,
+                                       args=(weakref.ref(self), self.stop_event),
+                                       name="rate-refresher", daemon=True)
+        self.finalizer = weakref.finalize(self, RateRefresher.stop_thread,
+                                          self.stop_event, self.thread, join_timeout)
+        self.thread.start()
+
+    @staticmethod
+    def stop_thread(stop_event, thread, timeout):
+        stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stop(self):
+        """Останавливаем поток и дожидаемся его завершения"""
+        self.finalizer()
+
+    def is_due(self, key, now):
+        if now < self.next_attempt.get(key, 0):
+            return False
+        # Курс мог уже обновить другой процесс
+        self.cache.sync(key)
+        entry = self.cache.get_entry(key)
+        if entry is None:
+            return True
+        return now - entry[1] >= self.cache.stores[key].expires - self.lead
+
+    def refresh_due(self):
+        for key, loader in self.loaders.items():
+            if self.stop_event.is_set():
+                return
+            now = time.time()
+            if not self.is_due(key, now):
+                continue
+            try:
+                self.cache.refresh(key, loader)
+            except Exception:
+                pass
+            entry = self.cache.get_entry(key)
+            if entry is None or entry[1] < now:
+                self.next_attempt[key] = now + self.retry_delay
+
+    @staticmethod
+    def run(ref, stop_event):
+        while not stop_event.is_set():
+            refresher = ref()
+            if refresher is None:
+                return
+            refresher.refresh_due()
+            poll = refresher.poll
+            del refresher
+            stop_event.wait(poll)
+
+@st.cache_resource
+def get_rate_refresher():
+    """Один фоновый поток обновления курсов на процесс"""
+    api = get_api_services()
+    return RateRefresher(
+        api.cache,
+        {key: partial(load_rate, api, key) for key in RATE_SOURCES}
+    )
+
+def peek_rate(key):
+    """Последний известный курс и его возраст в секундах без обращения
+    к сети (None - значение по умолчанию)"""
+    entry = get_shared_cache().get_entry(key)
+    if entry is None:
+        return RATE_SOURCES[key]["default"], None
+    return entry[0], time.time() - entry[1]
+
+def resolve_rates(deadline=RATES_DEADLINE):
+    """Снимок всех курсов: после прогрева сразу из кэша, при холодном
+    старте ждем загрузку не дольше deadline секунд"""
+    api = get_api_services()
+    cache = api.cache
+    get_rate_refresher()
+    # Уже идущие загрузки не дублируются: refresh_async вернет их Future
+    pending = [
+        cache.refresh_async(api.refresh_executor, key, partial(load_rate, api, key))
+        for key in RATE_SOURCES
+        if cache.get_entry(key) is None
+    ]
+    if pending:
+        wait(pending, timeout=deadline)
+    snapshot = {"values": {}, "ages": {}, "taken_at": time.time()}
+    for key in RATE_SOURCES:
+        snapshot["values"][key], snapshot["ages"][key] = peek_rate(key)
+    return snapshot
+
+def get_rates_snapshot(max_age=RATES_SNAPSHOT_TTL):
+    """Курсы для страницы. Перезапуски скрипта при редактировании
+    параметров берут снимок из session_state без кэша и сети"""
+    snapshot = st.session_state.get("rates_snapshot")
+    if snapshot is None or time.time() - snapshot["taken_at"] >= max_age:
+        snapshot = resolve_rates()
+        st.session_state.rates_snapshot = snapshot
+    return snapshot
+
+def refresh_rates():
+    """Принудительно обновляем курсы, дожидаясь результата. Курс, пришедший
+    в пакетном ответе вместе с предыдущим, повторно не запрашивается"""
+    api = get_api_services()
+    started = time.time()
+    for key, source in RATE_SOURCES.items():
+        entry = api.cache.get_entry(key)
+        if entry is None or entry[1] < started:
+            api.cache.refresh(key, partial(source["loader"], api), wait_for_result=True)
+
+def describe_rate_age(age):
+    """Подпись о свежести курса"""
+    if age is None:
+        return "Источники недоступны, используется значение по умолчанию"
+    if age < 60:
+        return f"Обновлено {int(age)} с назад"
+    return f"Обновлено {int(age // 60)} мин назад"
+
+def backoff_delay(attempt, base=MINING_RETRY_BASE_DELAY, cap=MINING_RETRY_MAX_DELAY):
+    """Экспоненциальная пауза перед повтором с полным джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def load_mining_data(api, hashrate_th, power_w, electricity_cost_usd, retries=3):
+    """Запрашиваем данные whattomine с повторными попытками"""
+    client = api.client
+    limiters = api.limiters
+    health = api.health
+    params = {
+        "hr": hashrate_th,
+        "p": power_w,
+        "cost": electricity_cost_usd,
+        "fee": 1.0,
+        "commit": "Calculate"
+    }
     for attempt in range(retries):
-        try:
-            params = {
-                "hr": hashrate_th,
-                "p": power_w,
-                "cost": electricity_cost_usd,
-                "fee": 1.0,
-                "commit": "Calculate"
-            }
-            response = requests.get("https://whattomine.com/coins/1.json", 
-                                 params=params, timeout=10)
-            data = response.json()
-            result = {
-                "daily_profit": float(data["profit"].replace('$', '').replace(',', '')),
-                "daily_revenue": float(data["revenue"].replace('$', '').replace(',', ''))
-            }
-            set_cached_data("mining_data", result)
-            return result
-        except:
-            if attempt == retries - 1:
-                return {
-                    "daily_profit": 12.50,
-                    "daily_revenue": 18.00
+        # Отключенный автоматом или исчерпавший лимит провайдер не опрашиваем
+        allowed = health.allow_request("whattomine")
+        if allowed and not limiters.try_acquire("whattomine"):
+            health.release_probe("whattomine")
+            allowed = False
+        if allowed:
+            started = time.monotonic()
+            try:
+                response = client.get(API_CONFIG["whattomine"]["url"], params=params)
+                data = response.json()
+                result = {
+                    "daily_profit": float(data["profit"].replace('$', '').replace(',', '')),
+                    "daily_revenue": float(data["revenue"].replace('$', '').replace(',', ''))
                 }
-            time.sleep(1 * (attempt + 1))
+            except Exception:
+                result = None
+            health.record("whattomine", result is not None, time.monotonic() - started)
+            if result is not None:
+                return result
+        if attempt < retries - 1:
+            time.sleep(backoff_delay(attempt))
+    return None
+
+def get_mining_data_with_retry(hashrate_th, power_w, electricity_cost_usd, retries=3,
+                               deadline=MINING_DATA_DEADLINE):
+    """Получаем данные о майнинге с повторными попытками. Ждем не дольше
+    deadline секунд: если не успели, возвращаем последние известные или
+    резервные данные, а попытки продолжаются в фоне и заполнят кэш"""
+    api = get_api_services()
+    cache = api.cache
+    key = mining_data_key(hashrate_th, power_w, electricity_cost_usd)
+    data = cache.get("mining_data", key)
+    if data is None:
+        future = cache.refresh_async(
+            api.refresh_executor,
+            "mining_data",
+            partial(load_mining_data, api, hashrate_th, power_w, electricity_cost_usd, retries),
+            key
+        )
+        try:
+            data = future.result(timeout=deadline)
+        except FuturesTimeoutError:
+            entry = cache.get_entry("mining_data", key)
+            data = entry[0] if entry else None
+    return data or {
+        "daily_profit": 12.50,
+        "daily_revenue": 18.00
+    }
 
 # --- Функции для работы со сценариями ---
 def add_scenario():
@@ -182,25 +1084,321 @@ def remove_scenario(index):
         else:
             st.session_state.scenarios[i]["start"] = st.session_state.scenarios[i-1]["end"] + 1
         st.session_state.scenarios[i]["end"] = st.session_state.scenarios[i]["start"] + 11
+    # Поля редактора хранят свои значения по номеру периода - сбрасываем их,
+    # чтобы они показали перенумерованные сценарии
+    for key in [key for key in st.session_state
+                if key.split("_")[0] in ("start", "end", "reinvest", "wallet")
+                and key.split("_")[-1].isdigit()]:
+        del st.session_state[key]
+
+def describe_break_even(break_even):
+    """Месяц окупаемости с уточнением в днях"""
+    if break_even["month"] is None:
+        return "Не окупилось"
+    return f"{break_even['month']} (≈{break_even['days']} дн.)"
+
+def summary_table(summary, rates, currency):
+    """Сводные данные расчета в выбранной валюте"""
+    rate = currency_rate(currency, rates)
+    decimals = CURRENCY_DECIMALS[currency]
+    return pd.DataFrame({
+        "Показатель": [
+            "Первоначальные инвестиции", 
+            "Окупаемость чистая (мес)", 
+            "Окупаемость грязная (мес)",
+            "Общая прибыль",
+            "Сумма за электрику"
+        ],
+        "Значение": [
+            format_number(summary["initial_investment"] / rate, decimals, currency),
+            describe_break_even(summary["clean_break_even"]),
+            describe_break_even(summary["dirty_break_even"]),
+            format_number(summary["total_profit"] / rate, decimals, currency),
+            format_number(summary["total_electricity"] / rate, decimals, currency)
+        ]
+    })
+
+def render_results(df, summary, rates, currency, height=None):
+    """Сводка и помесячная таблица; валюта пересчитывается при отображении"""
+    st.dataframe(
+        summary_table(summary, rates, currency).style.hide(axis="index"),
+        hide_index=True,
+        use_container_width=True
+    )
+
+    # Денежные столбцы форматируются целиком, без построчного Styler
+    view = format_columns(
+        add_wallet_column(convert_currency(df, currency, rates), currency),
+        MONEY_COLUMNS,
+        CURRENCY_DECIMALS[currency],
+        currency
+    )
+    table_options = {"height": height} if height else {}
+    st.dataframe(
+        view,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Месяц": st.column_config.NumberColumn(width="small"),
+            "ASIC": st.column_config.NumberColumn(width="small")
+        },
+        **table_options
+    )
+
+def currency_selector(key):
+    """Выбор валюты отображения"""
+    return st.radio("Валюта расчетов", list(CURRENCY_LABELS), format_func=CURRENCY_LABELS.get,
+                    horizontal=True, key=key)
 
-# --- Основные функции калькулятора ---
-def format_number(value, decimals=0, currency="rub"):
-    """Форматирует число с пробелами между тысячами"""
-    if pd.isna(value) or value == 0:
-        return "0"
+# --- Панели интерфейса ---
+@st.fragment(run_every=RATES_SNAPSHOT_TTL)
+def rates_panel():
+    """Курсы обновляются сами по таймеру, не перезапуская страницу"""
+    if st.button("🔄 Обновить курсы"):
+        refresh_rates()
+        st.session_state.rates_snapshot = resolve_rates()
+        st.success("Курсы обновлены!")
+
+    snapshot = get_rates_snapshot()
+    usd_rub = snapshot["values"]["usd_rub"]
+    btc_usd = snapshot["values"]["btc_price"]
+    st.metric("Курс USD/RUB", f"{format_number(usd_rub, 2)} ₽",
+              help=describe_rate_age(snapshot["ages"]["usd_rub"]))
+    st.metric("Цена BTC", f"{format_number(btc_usd, 2)} $",
+              help=describe_rate_age(snapshot["ages"]["btc_price"]))
+
+@st.fragment
+def api_status_panel():
+    """Статистика соединений, лимитов и источников - только по запросу"""
+    if not st.toggle("🔌 Состояние API"):
+        return
+    connection_stats = get_http_client().stats()
+    if connection_stats:
+        st.dataframe(pd.DataFrame(connection_stats), hide_index=True,
+                     use_container_width=True)
+    else:
+        st.caption("Запросов еще не было")
+    st.dataframe(pd.DataFrame(get_rate_limiters().stats()), hide_index=True,
+                 use_container_width=True)
+    st.dataframe(pd.DataFrame(get_provider_health().table()), hide_index=True,
+                 use_container_width=True)
+    mining_cache_stats = get_shared_cache().stats("mining_data")
+    st.caption(
+        "Кэш данных майнинга: {size}/{capacity} записей, попаданий {hits}, "
+        "промахов {misses}, вытеснено {evictions}".format(**mining_cache_stats)
+    )
+
+@st.fragment
+def scenario_editor():
+    """Редактор сценариев: изменения перезапускают только его"""
+    st.header("Сценарии доходности")
+    if not st.session_state.scenarios:
+        add_scenario()
+
+    for i, scenario in enumerate(st.session_state.scenarios):
+        with st.container(border=True):
+            cols = st.columns(2)
+            with cols[0]:
+                start = st.number_input("С", min_value=1, value=scenario['start'], 
+                                      key=f"start_{i}", step=1)
+            with cols[1]:
+                # Конец раньше начала не ограничиваем виджетом: такой период
+                # покажет проверка compile_scenarios
+                end = st.number_input("По", min_value=1, value=scenario['end'], 
+                                    key=f"end_{i}", step=1)
+            
+            reinvest = st.slider("Реинвестиции %", 0, 100, scenario['reinvest'], 
+                               key=f"reinvest_{i}")
+            wallet = st.slider("Кошелек %", 0, 100, scenario['wallet'], 
+                             key=f"wallet_{i}")
+            
+            # Колбэки выполняются до перезапуска, поэтому st.rerun не нужен
+            st.button("❌ Удалить", key=f"remove_{i}", on_click=remove_scenario, args=(i,))
+            
+            st.session_state.scenarios[i] = {
+                "start": start,
+                "end": end,
+                "reinvest": reinvest,
+                "wallet": wallet
+            }
+
+    st.button("➕ Добавить период", on_click=add_scenario)
+
+    # Проверяем раскладку сценариев до расчета
     try:
-        if decimals == 0:
-            formatted = "{:,.0f}".format(value).replace(",", " ")
-        else:
-            formatted = "{:,.{}f}".format(value, decimals).replace(",", " ").replace(".", ",")
+        st.session_state.scenario_error = None
+        for message in compile_scenarios(st.session_state.scenarios).warnings():
+            st.warning(message)
+    except ScenarioError as error:
+        st.session_state.scenario_error = str(error)
+        st.error(st.session_state.scenario_error)
+
+@st.fragment
+def results_view():
+    """Результаты расчета: смена валюты перезапускает только эту панель"""
+    if st.session_state.current_results is None or "current_rates" not in st.session_state:
+        return
+
+    display_currency = currency_selector("display_currency")
+    render_results(
+        st.session_state.current_results,
+        st.session_state.current_summary,
+        st.session_state.current_rates,
+        display_currency,
+        height=700
+    )
+
+    # Форма для сохранения
+    with st.form("save_form"):
+        result_name = st.text_input("Название сохранения", 
+                                  value=f"Результат {datetime.now().strftime('%Y-%m-%d %H:%M')}")
         
-        if currency == "usd":
-            return f"${formatted}"
-        elif currency == "rub":
-            return f"{formatted} ₽"
-        return formatted
-    except:
-        return str(value)
+        if st.form_submit_button("💾 Сохранить результаты"):
+            if result_name.strip():
+                try:
+                    saved = get_saved_results_store().save(
+                        result_name,
+                        datetime.now().isoformat(),
+                        st.session_state.current_params,
+                        st.session_state.current_rates,
+                        st.session_state.current_summary,
+                        store_results(
+                            st.session_state.current_results,
+                            st.session_state.current_params,
+                            st.session_state.current_params["scenarios"],
+                            st.session_state.current_rates,
+                            SAVED_RESULTS_STORAGE
+                        )
+                    )
+                except sqlite3.Error as error:
+                    st.error(f"Не удалось сохранить результат: {error}")
+                    saved = None
+                if saved is False:
+                    st.error("Результат с таким названием уже существует!")
+                elif saved:
+                    st.success(f"Результаты сохранены под названием: {result_name}")
+                    # Полный перезапуск, чтобы обновилась вкладка сохранений
+                    st.rerun()
+            else:
+                st.error("Введите название для сохранения")
+
+def saved_results_index(runs):
+    """Краткий список сохранений по метаданным из базы, без их таблиц"""
+    return pd.DataFrame([
+        {
+            "Название": run["name"],
+            "Сохранено": run["timestamp"][:16].replace("T", " "),
+            "ASIC": run["asic_count"],
+            "Инвестиции, ₽": run["initial_investment"],
+            "Окупаемость чистая, мес": run["clean_break_even"],
+            "Окупаемость грязная, мес": run["dirty_break_even"],
+            "Прибыль, ₽": run["total_profit"],
+            "Размер, КБ": run["packed_bytes"] / 1024
+        }
+        for run in runs
+    ])
+
+def delete_saved_result(name):
+    # Колбэк выполняется до отрисовки: ошибку покажет список сохранений
+    try:
+        get_saved_results_store().delete(name)
+    except sqlite3.Error as error:
+        st.session_state.saved_results_error = f"Не удалось удалить «{name}»: {error}"
+
+def render_saved_result(name, data):
+    """Полный просмотр одного сохранения"""
+    with st.expander("Параметры расчета"):
+        st.json(data["params"])
+    st.caption(describe_size(data["data"]))
+    
+    # Таблица хранится в рублях, валюта выбирается при просмотре
+    saved_currency = currency_selector(f"currency_{name}")
+    render_results(load_results(data["data"]), data["summary"], data["rates"],
+                   saved_currency)
+    
+    st.button(f"❌ Удалить {name}", on_click=delete_saved_result, args=(name,))
+
+def saved_results_filters():
+    """Панель фильтров и сортировки: границы {поле: (от, до)}, поле и
+    направление сортировки. Пустая граница не ограничивает"""
+    filters = {}
+    with st.expander("🔎 Фильтр и сортировка"):
+        for field in RUN_FILTER_FIELDS:
+            label = SAVED_RESULTS_FIELD_LABELS[field]
+            col_low, col_high = st.columns(2)
+            low = col_low.number_input(f"{label}: от", value=None, key=f"filter_{field}_low")
+            high = col_high.number_input(f"{label}: до", value=None, key=f"filter_{field}_high")
+            if low is not None or high is not None:
+                filters[field] = (low, high)
+        col_order, col_direction = st.columns([2, 1])
+        order_by = col_order.selectbox("Сортировать по", RUN_SORT_FIELDS,
+                                       format_func=SAVED_RESULTS_FIELD_LABELS.get,
+                                       key="saved_results_order")
+        descending = col_direction.radio("Порядок", ["По убыванию", "По возрастанию"],
+                                         key="saved_results_direction") == "По убыванию"
+    return filters, order_by, descending
+
+@st.fragment
+def saved_results_browser():
+    """Сохраненные результаты: список строится по сводкам, таблица - только
+    у выбранного сохранения; просмотр не затрагивает калькулятор"""
+    error = st.session_state.pop("saved_results_error", None)
+    if error:
+        st.error(error)
+    try:
+        store = get_saved_results_store()
+        total = store.count()
+    except sqlite3.Error as error:
+        st.error(f"База сохранений недоступна: {error}")
+        return
+    if not total:
+        st.info("Нет сохраненных результатов")
+        return
+
+    # Фильтры и сортировка выполняются запросом к индексам базы, из нее
+    # читается только текущая страница списка
+    filters, order_by, descending = saved_results_filters()
+    try:
+        found = store.count(filters)
+        if not found:
+            st.info(f"Ни одно из сохранений ({total}) не подходит под фильтр")
+            return
+        if filters:
+            st.caption(f"Найдено {found} из {total}")
+        pages = max(1, -(-found // SAVED_RESULTS_PAGE_SIZE))
+        page = 1
+        if pages > 1:
+            page = st.number_input(f"Страница (из {pages})", min_value=1, max_value=pages, value=1)
+        runs = store.list(SAVED_RESULTS_PAGE_SIZE, (page - 1) * SAVED_RESULTS_PAGE_SIZE,
+                          filters, order_by, descending)
+    except sqlite3.Error as error:
+        st.error(f"Не удалось прочитать список сохранений: {error}")
+        return
+    index = saved_results_index(runs)
+
+    st.dataframe(
+        index,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Инвестиции, ₽": st.column_config.NumberColumn(format="%.0f"),
+            "Прибыль, ₽": st.column_config.NumberColumn(format="%.0f"),
+            "Размер, КБ": st.column_config.NumberColumn(format="%.1f")
+        }
+    )
+
+    selected = st.selectbox("Открыть расчет", index["Название"].tolist(), index=None,
+                            placeholder="Выберите сохранение", key="selected_saved_result")
+    if selected is None:
+        return
+    try:
+        data = store.load(selected)
+    except sqlite3.Error as error:
+        st.error(f"Не удалось открыть «{selected}»: {error}")
+        return
+    if data is not None:
+        st.subheader(f"📌 {selected}")
+        render_saved_result(selected, data)
 
 # --- Интерфейс ---
 st.set_page_config(
@@ -226,327 +1424,59 @@ with tab1:
         asic_price = st.number_input("Стоимость 1 ASIC ($)", min_value=1, value=500)
         electricity = st.number_input("Электричество (руб/кВт·ч)", min_value=1.0, value=6.4)
         
-        show_in_usd = st.checkbox("Показать расчеты в $", value=False)
-        
-        if st.button("🔄 Обновить курсы"):
-            st.session_state.usd_rub_rate = get_usd_rub_rate()
-            st.session_state.btc_price_usd = get_btc_price()
-            st.success("Курсы обновлены!")
-        
-        usd_rub = get_usd_rub_rate()
-        btc_usd = get_btc_price()
-        st.metric("Курс USD/RUB", f"{format_number(usd_rub, 2)} ₽")
-        st.metric("Цена BTC", f"{format_number(btc_usd, 2)} $")
-
-        # Блок сценариев
-        st.header("Сценарии доходности")
-        if not st.session_state.scenarios:
-            add_scenario()
-
-        for i, scenario in enumerate(st.session_state.scenarios):
-            with st.container(border=True):
-                cols = st.columns(2)
-                with cols[0]:
-                    start = st.number_input("С", min_value=1, value=scenario['start'], 
-                                          key=f"start_{i}", step=1)
-                with cols[1]:
-                    end = st.number_input("По", min_value=start, value=scenario['end'], 
-                                        key=f"end_{i}", step=1)
-                
-                reinvest = st.slider("Реинвестиции %", 0, 100, scenario['reinvest'], 
-                                   key=f"reinvest_{i}")
-                wallet = st.slider("Кошелек %", 0, 100, scenario['wallet'], 
-                                 key=f"wallet_{i}")
-                
-                if st.button("❌ Удалить", key=f"remove_{i}"):
-                    remove_scenario(i)
-                    st.rerun()
-                
-                st.session_state.scenarios[i] = {
-                    "start": start,
-                    "end": end,
-                    "reinvest": reinvest,
-                    "wallet": wallet
-                }
-
-        if st.button("➕ Добавить период"):
-            add_scenario()
-            st.rerun()
+        rates_panel()
+        api_status_panel()
+        scenario_editor()
 
    # Кнопка расчета теперь в основном потоке, а не в колонке
-    if st.button("🔄 Рассчитать", type="primary", use_container_width=True):
+    # Кнопку не отключаем: редактор сценариев - фрагмент, и после исправления
+    # периодов она осталась бы отключенной до полного перезапуска
+    calculate = st.button("🔄 Рассчитать", type="primary", use_container_width=True)
+    if calculate and st.session_state.get("scenario_error"):
+        st.error(st.session_state.scenario_error)
+    elif calculate:
         with st.spinner("Выполняю расчет..."):
-            # Получаем данные
-            usd_rub = get_usd_rub_rate()
-            btc_usd = get_btc_price()
+            # Получаем данные; курсы из снимка сессии, без ожидания сети
+            rates = get_rates_snapshot()
+            usd_rub = rates["values"]["usd_rub"]
+            btc_usd = rates["values"]["btc_price"]
             electricity_usd = electricity / usd_rub
             
             # Получаем данные для 1 ASIC
             mining_data_per_asic = get_mining_data_with_retry(
                 asic_hashrate,
                 asic_power,
-                electricity_usd
+                electricity_usd,
+                deadline=MINING_DATA_DEADLINE
             )
             
-            # Масштабируем на количество ASIC
-            daily_profit_per_asic_usd = mining_data_per_asic["daily_profit"]
-            daily_cost_per_asic_usd = (asic_power / 1000) * 24 * electricity_usd
-            
-            daily_profit_per_asic_rub = daily_profit_per_asic_usd * usd_rub
-            daily_cost_per_asic_rub = (asic_power / 1000) * 24 * electricity
-            
-            # Инициализация
-            current_asics = asic_count
-            savings = 0
-            wallet_btc = 0
-            results = []
-            
-            # Для расчета окупаемости
-            total_investment = asic_count * asic_price * usd_rub
-            total_investment_usd = asic_count * asic_price
-            cumulative_profit = 0
-            break_even_month = None
-            
-            # Определяем общее количество месяцев из сценариев
-            total_months = max(s["end"] for s in st.session_state.scenarios) if st.session_state.scenarios else 12
-            
-            for month in range(1, total_months + 1):
-                # Находим активный сценарий для текущего месяца
-                active_scenario = None
-                for scenario in st.session_state.scenarios:
-                    if scenario["start"] <= month <= scenario["end"]:
-                        active_scenario = scenario
-                        break
-                
-                if not active_scenario:
-                    continue
-                
-                # Используем параметры из активного сценария
-                reinvest_percent = active_scenario["reinvest"]
-                wallet_percent = active_scenario["wallet"]
-                
-                # Расчет прибыли и расходов
-                profit = daily_profit_per_asic_rub * 30 * current_asics
-                cost = daily_cost_per_asic_rub * 30 * current_asics
-                
-                # Распределение средств
-                to_reinvest = profit * (reinvest_percent / 100)
-                salary = profit - to_reinvest
-                
-                to_wallet = to_reinvest * (wallet_percent / 100)
-                to_asics = to_reinvest - to_wallet
-                
-                savings += to_asics
-                btc_amount = to_wallet / usd_rub / btc_usd
-                wallet_btc += btc_amount
-                
-                # Покупка ASIC
-                new_asics = int(savings // (asic_price * usd_rub))
-                if new_asics > 0:
-                    current_asics += new_asics
-                    savings -= new_asics * asic_price * usd_rub
-                
-                # Расчет окупаемости
-                cumulative_profit += profit
-                if cumulative_profit >= total_investment and break_even_month is None:
-                    break_even_month = month
-                
-                # Конвертация в доллары если выбрано
-                if show_in_usd:
-                    profit_usd = profit / usd_rub
-                    cost_usd = cost / usd_rub
-                    salary_usd = salary / usd_rub
-                    to_reinvest_usd = to_reinvest / usd_rub
-                    to_wallet_usd = to_wallet / usd_rub
-                    savings_usd = savings / usd_rub
-                    
-                    results.append({
-                        "Месяц": month,
-                        "ASIC": current_asics,
-                        "Доходы": int(profit_usd + cost_usd),
-                        "Расходы": int(cost_usd),
-                        "Прибыль": int(profit_usd),
-                        "Зарплата": int(salary_usd),
-                        "Реинвест": int(to_reinvest_usd),
-                        "В кошелек": int(to_wallet_usd),
-                        "Накопления": int(savings_usd),
-                        "Кошелек": f"{wallet_btc:.8f} BTC (${format_number(wallet_btc * btc_usd, 2, 'usd')})"
-                    })
-                else:
-                    results.append({
-                        "Месяц": month,
-                        "ASIC": current_asics,
-                        "Доходы": int(profit + cost),
-                        "Расходы": int(cost),
-                        "Прибыль": int(profit),
-                        "Зарплата": int(salary),
-                        "Реинвест": int(to_reinvest),
-                        "В кошелек": int(to_wallet),
-                        "Накопления": int(savings),
-                        "Кошелек": f"{wallet_btc:.8f} BTC ({format_number(wallet_btc * btc_usd * usd_rub, 0, 'rub')})"
-                    })
-            
-            # Создаем DataFrame с результатами
-            df = pd.DataFrame(results)
+            # Помесячный расчет в рублях; та же конфигурация считается один раз
+            params = {
+                "asic_count": asic_count,
+                "asic_hashrate": asic_hashrate,
+                "asic_power": asic_power,
+                "asic_price": asic_price,
+                "electricity": electricity
+            }
+            simulation_rates = {
+                "usd_rub": usd_rub,
+                "btc_usd": btc_usd,
+                "daily_profit_usd": mining_data_per_asic["daily_profit"]
+            }
+            df = simulate(params, st.session_state.scenarios, simulation_rates)
             st.session_state.current_results = df
-            st.rerun()
+            st.session_state.current_params = {
+                **params,
+                "scenarios": [dict(scenario) for scenario in st.session_state.scenarios]
+            }
+            st.session_state.current_rates = simulation_rates
+            st.session_state.current_summary = summarize(df, params, simulation_rates)
 
-    # Отображение результатов в правой колонке
+    # Результаты выводятся в этом же прогоне скрипта: панель результатов
+    # идет после обработчика расчета и читает его итог из session_state
     with col_results:
-        if st.session_state.current_results is not None:
-            # Вычисляем сводные данные
-            df = st.session_state.current_results.copy()
-            
-            # Первоначальные инвестиции
-            initial_investment = asic_count * asic_price * (usd_rub if not show_in_usd else 1)
-            
-            # Окупаемость чистая (по зарплате + кошелек)
-            cumulative_salary_wallet = 0
-            clean_break_even_month = None
-            for _, row in df.iterrows():
-                salary = row['Зарплата']
-                wallet_value_str = row['Кошелек'].split('(')[1].split(')')[0].replace('$', '').replace('₽', '').replace(' ', '').replace(',', '.').strip()
-                try:
-                    wallet_value = float(wallet_value_str)
-                except ValueError:
-                    wallet_value = 0
-                cumulative_salary_wallet += salary + wallet_value
-                if cumulative_salary_wallet >= initial_investment and clean_break_even_month is None:
-                    clean_break_even_month = row['Месяц']
-            
-            # Окупаемость грязная (по прибыли)
-            cumulative_profit = df['Прибыль'].cumsum()
-            dirty_break_even_month = None
-            for _, row in df.iterrows():
-                if cumulative_profit[row['Месяц']-1] >= initial_investment:
-                    dirty_break_even_month = row['Месяц']
-                    break
-            
-            # Общая прибыль и затраты на электричество
-            total_profit = df['Прибыль'].sum()
-            total_electricity = df['Расходы'].sum()
-            
-            # Создаем таблицу со сводными данными
-            summary_data = {
-                "Показатель": [
-                    "Первоначальные инвестиции", 
-                    "Окупаемость чистая (мес)", 
-                    "Окупаемость грязная (мес)",
-                    "Общая прибыль",
-                    "Сумма за электрику"
-                ],
-                "Значение": [
-                    format_number(initial_investment, 0, "usd" if show_in_usd else "rub"),
-                    clean_break_even_month if clean_break_even_month else "Не окупилось",
-                    dirty_break_even_month if dirty_break_even_month else "Не окупилось",
-                    format_number(total_profit, 0, "usd" if show_in_usd else "rub"),
-                    format_number(total_electricity, 0, "usd" if show_in_usd else "rub")
-                ]
-            }
-            summary_df = pd.DataFrame(summary_data)
-            st.session_state.current_summary = summary_df.to_dict('records')
-            
-            # Отображаем сводные данные и основную таблицу
-            st.dataframe(
-                summary_df.style.hide(axis="index"),
-                hide_index=True,
-                use_container_width=True
-            )
-            
-            st.dataframe(
-                df.style.format({
-                    "Доходы": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub"),
-                    "Расходы": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub"),
-                    "Прибыль": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub"),
-                    "Зарплата": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub"),
-                    "Реинвест": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub"),
-                    "В кошелек": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub"),
-                    "Накопления": lambda x: format_number(x, 0, "usd" if show_in_usd else "rub")
-                }),
-                hide_index=True,
-                use_container_width=True,
-                height=700,
-                column_config={
-                    "Месяц": st.column_config.NumberColumn(width="small"),
-                    "ASIC": st.column_config.NumberColumn(width="small")
-                }
-            )
+        results_view()
 
-            # Форма для сохранения
-            with st.form("save_form"):
-                result_name = st.text_input("Название сохранения", 
-                                          value=f"Результат {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-                
-                if st.form_submit_button("💾 Сохранить результаты"):
-                    if result_name.strip():
-                        if result_name in st.session_state.saved_results:
-                            st.error("Результат с таким названием уже существует!")
-                        else:
-                            st.session_state.saved_results[result_name] = {
-                                "timestamp": datetime.now().isoformat(),
-                                "data": st.session_state.current_results.to_dict('records'),
-                                "summary": st.session_state.current_summary,
-                                "params": {
-                                    "asic_count": asic_count,
-                                    "asic_hashrate": asic_hashrate,
-                                    "asic_power": asic_power,
-                                    "asic_price": asic_price,
-                                    "electricity": electricity,
-                                    "show_in_usd": show_in_usd,
-                                    "usd_rub_rate": usd_rub,
-                                    "btc_price_usd": btc_usd,
-                                    "scenarios": st.session_state.scenarios.copy()
-                                }
-                            }
-                            st.success(f"Результаты сохранены под названием: {result_name}")
-                            st.rerun()
-                    else:
-                        st.error("Введите название для сохранения")
 with tab2:
     st.title("📁 Сохраненные результаты")
-    
-    # Проверяем наличие сохраненных результатов в session_state
-    if not st.session_state.get('saved_results', {}):
-        st.info("Нет сохраненных результатов")
-    else:
-        # Создаем копию словаря, чтобы избежать изменений во время итерации
-        saved_results_copy = st.session_state.saved_results.copy()
-        
-        for name, data in saved_results_copy.items():
-            with st.expander(f"📌 {name} ({data['timestamp']})"):
-                st.write("Параметры расчета:")
-                st.json(data["params"])
-                
-                # Отображаем сводные данные
-                if "summary" in data:
-                    st.write("Сводные данные:")
-                    summary_df = pd.DataFrame(data["summary"])
-                    st.dataframe(
-                        summary_df.style.hide(axis="index"),
-                        hide_index=True,
-                        use_container_width=True
-                    )
-                
-                # Восстанавливаем DataFrame
-                df = pd.DataFrame(data["data"])
-                
-                # Определяем валюту для форматирования
-                show_in_usd_saved = data["params"].get("show_in_usd", False)
-                
-                st.dataframe(
-                    df.style.format({
-                        "Доходы": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub"),
-                        "Расходы": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub"),
-                        "Прибыль": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub"),
-                        "Зарплата": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub"),
-                        "Реинвест": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub"),
-                        "В кошелек": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub"),
-                        "Накопления": lambda x: format_number(x, 0, "usd" if show_in_usd_saved else "rub")
-                    }),
-                    hide_index=True,
-                    use_container_width=True
-                )
-                
-                if st.button(f"❌ Удалить {name}"):
-                    del st.session_state.saved_results[name]
-                    st.rerun()
\ No newline at end of file
+    saved_results_browser()
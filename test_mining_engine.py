@@ -0,0 +1,115 @@
+import random
+import unittest
+
+import numpy as np
+
+from mining_engine import run_simulation
+
+def reference_simulation(params, scenarios, rates):
+    """Исходный помесячный цикл расчета, с которым сверяется векторизованный:
+    те же операции в том же порядке, без округления для вывода"""
+    usd_rub = rates["usd_rub"]
+    btc_usd = rates["btc_usd"]
+    asic_price = params["asic_price"]
+    daily_profit_per_asic_rub = rates["daily_profit_usd"] * usd_rub
+    daily_cost_per_asic_rub = (params["asic_power"] / 1000) * 24 * params["electricity"]
+
+    current_asics = params["asic_count"]
+    savings = 0
+    wallet_btc = 0
+    rows = []
+    total_months = max(s["end"] for s in scenarios) if scenarios else 12
+    for month in range(1, total_months + 1):
+        active_scenario = None
+        for scenario in scenarios:
+            if scenario["start"] <= month <= scenario["end"]:
+                active_scenario = scenario
+                break
+        if not active_scenario:
+            continue
+
+        profit = daily_profit_per_asic_rub * 30 * current_asics
+        cost = daily_cost_per_asic_rub * 30 * current_asics
+        to_reinvest = profit * (active_scenario["reinvest"] / 100)
+        salary = profit - to_reinvest
+        to_wallet = to_reinvest * (active_scenario["wallet"] / 100)
+        to_asics = to_reinvest - to_wallet
+
+        savings += to_asics
+        wallet_btc += to_wallet / usd_rub / btc_usd
+
+        new_asics = int(savings // (asic_price * usd_rub))
+        if new_asics > 0:
+            current_asics += new_asics
+            savings -= new_asics * asic_price * usd_rub
+
+        rows.append((month, current_asics, profit + cost, cost, profit, salary,
+                     to_reinvest, to_wallet, savings, wallet_btc))
+    return rows
+
+def random_case(rng):
+    scenarios = []
+    start = 1
+    for _ in range(rng.randint(1, 4)):
+        # Периоды идут подряд, иногда с пропусками и пересечениями
+        start = max(1, start + rng.randint(-3, 3))
+        end = start + rng.randint(0, 60)
+        scenarios.append({"start": start, "end": end,
+                          "reinvest": rng.randint(0, 100), "wallet": rng.randint(0, 100)})
+        start = end + 1
+    params = {
+        "asic_count": rng.randint(1, 50),
+        "asic_power": rng.choice([100, 1500, 3250, 3600]),
+        "asic_price": rng.choice([300, 500, 1999, 5000]),
+        "electricity": round(rng.uniform(1, 10), 2)
+    }
+    rates = {
+        "usd_rub": rng.uniform(60, 110),
+        "btc_usd": rng.uniform(20000, 120000),
+        "daily_profit_usd": rng.uniform(0.5, 40)
+    }
+    return params, scenarios, rates
+
+class RunSimulationEquivalenceTest(unittest.TestCase):
+    COLUMNS = ("Месяц", "ASIC", "Доходы", "Расходы", "Прибыль", "Зарплата",
+               "Реинвест", "В кошелек", "Накопления", "wallet_btc")
+
+    def assert_matches_reference(self, params, scenarios, rates):
+        expected = reference_simulation(params, scenarios, rates)
+        df = run_simulation(params, scenarios, rates)
+        self.assertEqual(len(df), len(expected))
+        for position, column in enumerate(self.COLUMNS):
+            np.testing.assert_array_equal(
+                df[column].to_numpy(dtype=float),
+                np.array([row[position] for row in expected], dtype=float),
+                err_msg=f"{column}: {params} {scenarios} {rates}"
+            )
+
+    def test_purchase_boundary(self):
+        # Покупка на границе округления: списание цены в другом порядке
+        # операций давало на один ASIC меньше
+        self.assert_matches_reference(
+            {"asic_count": 46, "asic_power": 100, "asic_price": 5000, "electricity": 3.3},
+            [
+                {"start": 1, "end": 12, "reinvest": 80, "wallet": 0},
+                {"start": 10, "end": 44, "reinvest": 19, "wallet": 95},
+                {"start": 45, "end": 87, "reinvest": 71, "wallet": 13}
+            ],
+            {"usd_rub": 62.814308979323386, "btc_usd": 80608.61448463943,
+             "daily_profit_usd": 12.5}
+        )
+
+    def test_long_horizon_without_purchases(self):
+        self.assert_matches_reference(
+            {"asic_count": 3, "asic_power": 3600, "asic_price": 500, "electricity": 6.4},
+            [{"start": 1, "end": 600, "reinvest": 40, "wallet": 100}],
+            {"usd_rub": 90.0, "btc_usd": 60000.0, "daily_profit_usd": 12.5}
+        )
+
+    def test_random_configurations(self):
+        rng = random.Random(20261015)
+        for _ in range(300):
+            self.assert_matches_reference(*random_case(rng))
+
+if __name__ == "__main__":
+    unittest.main()